@@ -1,21 +1,116 @@
 #!/usr/bin/env python3
 
+import asyncio
+import csv
 import os
-import json
 import logging
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
 from dotenv import load_dotenv
-import requests as r
+import httpx
+import orjson
 import pandas as pd
 from tqdm import tqdm
 
-# Load environment variables
-load_dotenv()
+# Avoid defensive DataFrame copies when slicing/assigning columns
+pd.options.mode.copy_on_write = True
 
 # Constants
-VOUCHED_PRIVATE_API_KEY = os.getenv('VOUCHED_PRIVATE_API_KEY')
 TIN_ENDPOINT = 'https://verify.vouched.id/api/tin/verify'
-CALLBACK_URL = os.getenv('CALLBACK_URL')
+
+# Only this much of a response body is ever read; the fields we keep are
+# tiny, and error pages can be arbitrarily large HTML
+MAX_RESPONSE_BYTES = 65536
+
+# Retry policy for transient failures (connect errors and 429/5xx)
+RETRY_TOTAL = 5
+RETRY_BACKOFF = 0.25
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Environment-derived configuration, bound once by load_config() in main
+# (after load_dotenv) rather than read at import time
+CALLBACK_URL = None
+HEADERS = None
+MAX_CONCURRENCY = None
+_build_payload = None
+
+def _make_payload_builder(callback_url):
+    """Specialize payload encoding for the fixed schema.
+
+    The static keys and the tinType/callbackURL tail are encoded once
+    here; the returned builder produces the request body for a row by
+    concatenating bytes around the four orjson-escaped field values —
+    no per-row dict or full-document serialization.
+    """
+    dumps = orjson.dumps
+    first_key = b'{"firstName":'
+    last_key = b',"lastName":'
+    tin_key = b',"tin":'
+    phone_key = b',"phone":'
+    tail = b',"tinType":"ITIN","callbackURL":' + dumps(callback_url) + b'}'
+
+    def build(first_name, last_name, tin, phone):
+        return (first_key + dumps(first_name)
+                + last_key + dumps(last_name)
+                + tin_key + dumps(tin)
+                + phone_key + dumps(phone)
+                + tail)
+
+    return build
+
+def load_config():
+    """Read and validate environment configuration, binding it once.
+
+    Must run before any verification requests; raises if the API key is
+    missing so a misconfigured run fails up front instead of stamping a
+    None key into every request header.
+    """
+    global CALLBACK_URL, HEADERS, MAX_CONCURRENCY, _build_payload
+
+    load_dotenv()
+
+    api_key = os.getenv('VOUCHED_PRIVATE_API_KEY')
+    if not api_key:
+        logging.error("VOUCHED_PRIVATE_API_KEY environment variable is not set")
+        raise ValueError("VOUCHED_PRIVATE_API_KEY environment variable is required")
+
+    CALLBACK_URL = os.getenv('CALLBACK_URL')
+    if not CALLBACK_URL:
+        logging.warning("CALLBACK_URL environment variable is not set - callbacks will not work")
+
+    # Maximum number of in-flight verification requests; the client's
+    # connection pool is sized to match
+    MAX_CONCURRENCY = int(os.getenv('TIN_CONCURRENCY', '100'))
+
+    # Precompute the header dict and the payload builder so per-row code
+    # only fills in the varying fields
+    HEADERS = {
+        'X-API-Key': api_key,
+        'Content-Type': 'application/json'
+    }
+    _build_payload = _make_payload_builder(CALLBACK_URL)
+
+def setup_logging():
+    """Route log records through a queue so hot-path log calls just enqueue.
+
+    Formatting and I/O happen on a background QueueListener thread instead
+    of serializing the workers on the handler lock. Returns the listener;
+    callers must stop() it on shutdown to drain the queue.
+    """
+    queue = Queue(-1)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    listener = QueueListener(queue, handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(QueueHandler(queue))
+    # httpx/httpcore log every request (and retry) at INFO; that would put
+    # a log line per row right back on the hot path, so keep them quiet
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    logging.getLogger('httpcore').setLevel(logging.WARNING)
+    listener.start()
+    return listener
 
 def load_file(file_path=None):
     """Load and validate the input CSV file."""
@@ -23,7 +118,7 @@ def load_file(file_path=None):
         file_path = input('Enter the path to the file: ')
     
     try:
-        df = pd.read_csv(file_path)
+        df = pd.read_csv(file_path, engine='pyarrow', dtype_backend='pyarrow')
         logging.info(f"Loaded file: {file_path} with {len(df)} rows")
     except FileNotFoundError:
         logging.error(f"File not found: {file_path}")
@@ -44,56 +139,90 @@ def load_file(file_path=None):
     for col in required_columns:
         if df[col].isna().any():
             logging.warning(f"Found empty values in column '{col}'")
-    
+
+    # Normalize the payload columns once here so the per-row hot path
+    # doesn't have to cast and strip every field
+    for col in required_columns:
+        df[col] = df[col].astype('string').str.strip().fillna('')
+
     return df
 
-def run_tin_verification(row, index):
-    """Make a request to the Vouched TIN Verification API for a single row."""
+async def post_capped(client, content):
+    """POST the encoded payload with bounded retries and a capped body read.
+
+    Returns (status_code, body, truncated); at most MAX_RESPONSE_BYTES of
+    the response body is read.
+    """
+    for attempt in range(RETRY_TOTAL + 1):
+        try:
+            async with client.stream('POST', TIN_ENDPOINT, content=content) as response:
+                if response.status_code in RETRY_STATUSES and attempt < RETRY_TOTAL:
+                    await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+                    continue
+                chunks = []
+                size = 0
+                async for chunk in response.aiter_bytes():
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size > MAX_RESPONSE_BYTES:
+                        break
+                return response.status_code, b''.join(chunks), size > MAX_RESPONSE_BYTES
+        except httpx.TransportError:
+            if attempt < RETRY_TOTAL:
+                await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+                continue
+            raise
+
+
+async def run_tin_verification(client, row, index, semaphore):
+    """Make a request to the Vouched TIN Verification API for a single row.
+
+    `row` is a (firstName, lastName, tin, phone) array of strings,
+    already stripped by `load_file`. `semaphore` bounds the number of
+    requests in flight at once.
+    """
     try:
-        payload = {
-            'firstName': str(row['firstName']).strip(),
-            'lastName': str(row['lastName']).strip(),
-            'tin': str(row['tin']).strip(),
-            'phone': str(row['phone']).strip(),
-            'tinType': 'ITIN',
-            'callbackURL': CALLBACK_URL
-        }
-        
-        headers = {
-            'X-API-Key': VOUCHED_PRIVATE_API_KEY,
-            'Content-Type': 'application/json'
-        }
-        
-        response = r.post(TIN_ENDPOINT, headers=headers, json=payload, timeout=30)
-        
-        logging.info(f"Row {index}: {response.status_code}")
-        
+        # The builder emits the encoded body directly — no per-row payload
+        # dict; the content-type is already set on the client, so httpx
+        # sends the bytes as-is
+        content = _build_payload(row[0], row[1], row[2], row[3])
+
+        async with semaphore:
+            status_code, body, truncated = await post_capped(client, content)
+
+        # No per-row success logging here — failures are logged below and
+        # the progress bar already tracks throughput
+
         # Always try to get the response content, regardless of status code
         try:
-            response_data = response.json()
+            response_data = orjson.loads(body)
         except:
-            # If JSON parsing fails, get the raw text
-            response_data = response.text
-        
-        if response.status_code == 200:
+            # If JSON parsing fails, keep the raw text
+            response_data = body[:MAX_RESPONSE_BYTES].decode('utf-8', errors='replace')
+            if truncated:
+                response_data += '... [truncated]'
+
+        if status_code == 200:
             return {
-                'status_code': response.status_code,
+                'status_code': status_code,
                 'success': True,
                 'response': response_data,
                 'error': None
             }
         else:
             # For non-200 status codes, include the actual response in the error field
-            logging.error(f"Row {index}: API request failed with status {response.status_code}. Response: {response_data}")
+            logging.error(f"Row {index}: API request failed with status {status_code}. Response: {response_data}")
             return {
-                'status_code': response.status_code,
+                'status_code': status_code,
                 'success': False,
                 'response': response_data,  # Include the actual response
                 'error': response_data  # Use the actual response as the error message
             }
-            
-    except r.exceptions.Timeout:
-        error_msg = "Request timeout"
+
+    except httpx.HTTPError as e:
+        # Retries already happened in post_capped; whatever reaches here
+        # is terminal, so just report it
+        error_msg = f"Request error: {str(e)}"
         logging.error(f"Row {index}: {error_msg}")
         return {
             'status_code': None,
@@ -101,24 +230,6 @@ def run_tin_verification(row, index):
             'response': None,
             'error': error_msg
         }
-    except r.exceptions.RequestException as e:
-        # For request exceptions, try to get response if available
-        error_msg = f"Request error: {str(e)}"
-        response_content = None
-        if hasattr(e, 'response') and e.response is not None:
-            try:
-                response_content = e.response.json()
-            except:
-                response_content = e.response.text
-            error_msg = f"Request error: {str(e)}. Response: {response_content}"
-        
-        logging.error(f"Row {index}: {error_msg}")
-        return {
-            'status_code': getattr(e.response, 'status_code', None) if hasattr(e, 'response') and e.response else None,
-            'success': False,
-            'response': response_content,
-            'error': error_msg
-        }
     except Exception as e:
         error_msg = f"Unexpected error: {str(e)}"
         logging.error(f"Row {index}: {error_msg}")
@@ -130,108 +241,132 @@ def run_tin_verification(row, index):
         }
 
 def extract_specific_fields(json_obj):
-    """Extract only the specific fields we want from the API response."""
-    extracted = {}
-    
-    if isinstance(json_obj, dict):
-        # Extract id
-        if 'id' in json_obj:
-            extracted['id'] = json_obj['id']
-        
-        # Extract submitted (from submitted field)
-        if 'submitted' in json_obj:
-            extracted['submitted'] = json_obj['submitted']
-        
-        # Extract result.status (nested field)
-        if 'result' in json_obj and isinstance(json_obj['result'], dict):
-            if 'status' in json_obj['result']:
-                extracted['result_status'] = json_obj['result']['status']
-    
-    elif isinstance(json_obj, str):
-        # If the response is a string (error message), include it
-        extracted['raw_response'] = json_obj
-    
-    return extracted
+    """Extract (id, submitted, result_status) from an API response.
 
-def save_results_to_csv(df, results, output_file='tin_verification_results.csv'):
-    """Save the original DataFrame with API results to a CSV file."""
-    try:
-        # Create a copy of the original DataFrame
-        result_df = df.copy()
-        
-        # Add basic API result columns
-        result_df['api_status_code'] = [r['status_code'] for r in results]
-        result_df['api_success'] = [r['success'] for r in results]
-        result_df['api_error'] = [r['error'] for r in results]
-        
-        # Collect all possible response columns from all responses
-        all_response_columns = set()
-        extracted_responses = []
-        
-        for result in results:
-            if result['success'] and result['response']:
-                # Extract only the specific fields we want
-                extracted = extract_specific_fields(result['response'])
-                extracted_responses.append(extracted)
-                all_response_columns.update(extracted.keys())
-            else:
-                extracted_responses.append({})
-        
-        # Add all response columns to DataFrame
-        for col in sorted(all_response_columns):
-            result_df[f'api_response_{col}'] = None
-            for i, extracted in enumerate(extracted_responses):
-                if extracted:
-                    result_df.at[i, f'api_response_{col}'] = extracted.get(col)
-        
-        # Save to CSV
-        result_df.to_csv(output_file, index=False)
-        logging.info(f"Results saved to {output_file}")
-        return result_df
-        
-    except Exception as e:
-        logging.error(f"Error saving results to CSV: {e}")
-        raise
+    Non-dict responses (raw error text) are carried in the result_status
+    slot so they still surface in the output.
+    """
+    if not isinstance(json_obj, dict):
+        return (None, None, json_obj if isinstance(json_obj, str) else None)
+    result = json_obj.get('result')
+    return (
+        json_obj.get('id'),
+        json_obj.get('submitted'),
+        result.get('status') if isinstance(result, dict) else None,
+    )
 
-def save_raw_responses(results, output_file='raw_api_responses.json'):
-    """Save raw API responses for debugging purposes."""
+# API result columns appended after the input columns in the output CSV
+RESULT_COLUMNS = [
+    'api_status_code',
+    'api_success',
+    'api_error',
+    'api_response_id',
+    'api_response_submitted',
+    'api_response_result_status',
+]
+
+def result_to_row(values, result):
+    """Flatten one input row plus its API result into an output CSV row."""
+    if result['success'] and result['response']:
+        response_id, submitted, status = extract_specific_fields(result['response'])
+    else:
+        response_id = submitted = status = None
+    error = result['error']
+    return [
+        *values,
+        result['status_code'],
+        result['success'],
+        # Errors can be dicts (parsed API error bodies); stringify for CSV
+        None if error is None else str(error),
+        response_id,
+        submitted,
+        status,
+    ]
+
+def write_raw_response(handle, index, result):
+    """Append one raw API result as an NDJSON line for debugging purposes."""
     try:
-        with open(output_file, 'w') as f:
-            json.dump(results, f, indent=2, default=str)
+        handle.write(orjson.dumps(
+            {'row': index, **result}, default=str, option=orjson.OPT_APPEND_NEWLINE
+        ))
     except Exception as e:
-        logging.error(f"Error saving raw responses: {e}")
+        logging.error(f"Error saving raw response for row {index}: {e}")
 
-def main():
+async def main():
     """Main function to orchestrate the TIN verification process."""
+    listener = setup_logging()
     try:
-        # Validate environment variables
-        if not VOUCHED_PRIVATE_API_KEY:
-            logging.error("VOUCHED_PRIVATE_API_KEY environment variable is not set")
-            raise ValueError("VOUCHED_PRIVATE_API_KEY environment variable is required")
-        
-        if not CALLBACK_URL:
-            logging.warning("CALLBACK_URL environment variable is not set - callbacks will not work")
-        
+        # Read and validate environment configuration
+        load_config()
+
         # Load the input file
         df = load_file()
         
-        # Initialize results list
-        results = []
-        
-        # Process each row
-        logging.info(f"Starting TIN verification for {len(df)} rows")
-        for index, row in tqdm(df.iterrows(), total=len(df), desc="Processing TIN verifications", unit="requests"):
-            result = run_tin_verification(row, index)
-            results.append(result)
-        
-        # Save results
-        result_df = save_results_to_csv(df, results)
-        save_raw_responses(results)
-        
+        # Process rows concurrently on one event loop; a single connection
+        # pool fans out up to MAX_CONCURRENCY in-flight requests
+        logging.info(f"Starting TIN verification for {len(df)} rows with up to {MAX_CONCURRENCY} in flight")
+        # Pull the payload columns out into a single string array up front so
+        # the hot loop hands workers plain tuples instead of pandas rows
+        cols = df[['firstName', 'lastName', 'tin', 'phone']].to_numpy()
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+        # Both outputs are streamed out as rows complete through large write
+        # buffers, so flushes are amortized across many records and no
+        # per-row result has to be kept once its line is on disk
+        with open('tin_verification_results.csv', 'w', newline='', buffering=1 << 20) as results_file, \
+                open('raw_api_responses.json', 'wb', buffering=1 << 20) as raw_file, \
+                tqdm(total=len(df), desc="Processing TIN verifications", unit="requests") as progress:
+            results_writer = csv.writer(results_file)
+            results_writer.writerow([*df.columns, *RESULT_COLUMNS])
+            # HTTP/2 multiplexes the in-flight requests over a handful of
+            # connections instead of one connection each; if the server
+            # doesn't negotiate h2 the client falls back to HTTP/1.1
+            async with httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=MAX_CONCURRENCY,
+                    max_keepalive_connections=MAX_CONCURRENCY
+                ),
+                timeout=httpx.Timeout(30.0),
+                headers=HEADERS
+            ) as client:
+                successful_requests = 0
+                failed_requests = 0
+
+                async def verify_row(index):
+                    nonlocal successful_requests, failed_requests
+                    result = await run_tin_verification(client, cols[index], index, semaphore)
+                    # Tally here so the summary doesn't need another full
+                    # pass over the results
+                    if result['success']:
+                        successful_requests += 1
+                    else:
+                        failed_requests += 1
+                    write_raw_response(raw_file, index, result)
+                    progress.update(1)
+                    return result
+
+                # Process in windows a few times the in-flight limit, so
+                # the task list, the retained results, and the input rows
+                # echoed into the CSV are all bounded by the window size
+                # instead of the row count — and rows still land in input
+                # order. The semaphore keeps requests saturated across the
+                # whole window; only the window boundary waits for
+                # stragglers.
+                window_size = MAX_CONCURRENCY * 4
+                for start in range(0, len(cols), window_size):
+                    stop = min(start + window_size, len(cols))
+                    window_results = await asyncio.gather(
+                        *(verify_row(index) for index in range(start, stop))
+                    )
+                    # Missing input values become None so they serialize
+                    # as empty CSV fields rather than "<NA>"
+                    window_values = df.iloc[start:stop].to_numpy(na_value=None)
+                    for offset, result in enumerate(window_results):
+                        results_writer.writerow(result_to_row(window_values[offset], result))
+
+        logging.info("Results saved to tin_verification_results.csv")
+
         # Print summary
-        successful_requests = sum(1 for r in results if r['success'])
-        failed_requests = len(results) - successful_requests
-        
         logging.info(f"Processing complete. Successful: {successful_requests}, Failed: {failed_requests}")
         print(f"\nTIN Verification Complete!")
         print(f"Total rows processed: {len(df)}")
@@ -243,6 +378,8 @@ def main():
     except Exception as e:
         logging.error(f"Fatal error in main: {e}")
         raise
+    finally:
+        listener.stop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file